@@ -0,0 +1,124 @@
+import asyncio
+from dataclasses import dataclass
+from operator import itemgetter
+from urllib.parse import parse_qsl
+from starlette.responses import JSONResponse
+
+from apl_api.cost import RATE_LIMIT_DETAIL, client_key
+
+
+@dataclass
+class CoalesceStats:
+    requests: int = 0  # Requests that went through the single-flight layer
+    executions: int = 0  # Requests that actually ran the route handler
+    coalesced: int = 0  # Requests answered with another request's response
+
+
+def coalesce_key(scope) -> tuple:
+    """
+    Normalize a request so that equivalent lookups share a key
+
+    Query parameters are order independent and pattern names are case insensitive.
+    Repeated parameters keep their relative order, since the last value wins, and
+    blank values are kept because they fail validation rather than being ignored.
+    """
+    path = scope["path"]
+    if path.startswith("/name/"):
+        path = path.lower()
+    query = sorted(
+        parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True),
+        key=itemgetter(0),
+    )
+    return path, tuple(query)
+
+
+def is_shareable(messages) -> bool:
+    """
+    Whether captured ASGI messages form a complete, successful response
+    """
+    return (
+        bool(messages)
+        and messages[0].get("status") == 200
+        and messages[-1]["type"] == "http.response.body"
+        and not messages[-1].get("more_body", False)
+    )
+
+
+class CoalesceMiddleware:
+    """
+    Single-flight layer for GET requests to `paths`
+
+    Concurrent requests with the same key wait for the first one to finish and
+    are answered with its serialized response instead of running the handler
+    again. Only successful responses are shared, so errors such as rate limits
+    are never handed to other clients; those waiters run their own request.
+
+    Waiters skip the route dependencies, so each one is charged to `limiter` for
+    the query cost the first request recorded in `request.state.query_cost`.
+    """
+
+    def __init__(self, app, paths=("/id/", "/name/"), stats=None, limiter=None):
+        self.app = app
+        self.paths = tuple(paths)
+        self.stats = stats if stats is not None else CoalesceStats()
+        self.limiter = limiter
+        self._flights = {}
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or not scope["path"].startswith(self.paths)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        self.stats.requests += 1
+        key = coalesce_key(scope)
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            result = await asyncio.shield(flight)
+            if result is not None:
+                messages, cost = result
+                if self.limiter is not None and cost:
+                    retry_after = self.limiter.charge(client_key(scope), cost)
+                    if retry_after:
+                        response = JSONResponse(
+                            {"detail": RATE_LIMIT_DETAIL},
+                            status_code=429,
+                            headers={"Retry-After": str(retry_after)},
+                        )
+                        await response(scope, receive, send)
+                        return
+                self.stats.coalesced += 1
+                for message in messages:
+                    await send(message)
+                return
+            self.stats.executions += 1
+            await self.app(scope, receive, send)
+            return
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        self.stats.executions += 1
+        messages = []
+
+        async def capture(message):
+            messages.append(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            del self._flights[key]
+            if is_shareable(messages):
+                cost = scope.get("state", {}).get("query_cost", 0)
+                flight.set_result((messages, cost))
+            else:
+                flight.set_result(None)
+
+        for message in messages:
+            await send(message)
+
+
+stats = CoalesceStats()
@@ -8,6 +8,12 @@ class Settings(BaseSettings):
     """
     database: str = "apl.db"
     update_interval: int = 1  # In days, how often to check for Markdown file updates
+    max_query_cost: int = 5000  # Estimated patterns above which requests are rejected
+    max_query_bytes: int = 5_000_000  # Estimated response size to reject requests at
+    max_response_nodes: int = 1000  # Patterns returned before links are truncated
+    max_response_bytes: int = 1_000_000  # Approximate response size before truncation
+    rate_limit_capacity: int = 2000  # Query cost a single client can spend in a burst
+    rate_limit_refill_rate: float = 50  # Query cost restored to each client per second
     swagger_ui: dict = {
         "syntaxHilight.activated": True,
         "syntaxHighlight.theme": "obsidian",
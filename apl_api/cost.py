@@ -0,0 +1,214 @@
+import math
+import threading
+import time
+from dataclasses import dataclass
+from sqlmodel import Session, select
+
+from apl_api.config import settings
+from apl_api.models import PatternLinks, Patterns
+
+MAX_DEPTH = 3
+
+# Rough size of the JSON keys and punctuation wrapped around each serialized pattern
+NODE_OVERHEAD_BYTES = 150
+
+RATE_LIMIT_DETAIL = "Rate limit exceeded"
+
+
+def node_size(pattern: Patterns) -> int:
+    """
+    Approximate number of bytes a single pattern adds to a serialized response
+    """
+    text = pattern.name + pattern.problem + pattern.solution + pattern.tag
+    return len(text.encode("utf-8")) + NODE_OVERHEAD_BYTES
+
+
+@dataclass
+class QueryCost:
+    nodes: int
+    bytes: int
+
+
+class NeighborhoodIndex:
+    """
+    Precomputed size of the tree `get_pattern` builds for every pattern and depth
+
+    Links are followed in both directions, so a node expanded at depth d contains
+    itself plus the depth d - 1 trees of all its forward links and backlinks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Held while loading so concurrent requests share a single rebuild
+        self._load_lock = threading.Lock()
+        self._nodes = []
+        self._bytes = []
+        # Bumped by clear() so a load that read the old database is never installed
+        self._generation = 0
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._nodes = []
+            self._bytes = []
+
+    def load(self, session: Session) -> tuple[list, list]:
+        with self._lock:
+            generation = self._generation
+
+        patterns = {
+            pattern.id: node_size(pattern) for pattern in session.exec(select(Patterns))
+        }
+        neighbors = {pattern_id: set() for pattern_id in patterns}
+        for link in session.exec(select(PatternLinks)):
+            if link.pattern_id in patterns and link.linked_pattern_id in patterns:
+                neighbors[link.pattern_id].add(("forward", link.linked_pattern_id))
+                neighbors[link.linked_pattern_id].add(("back", link.pattern_id))
+
+        nodes = [{pattern_id: 1 for pattern_id in patterns}]
+        sizes = [dict(patterns)]
+        for _ in range(MAX_DEPTH):
+            previous_nodes, previous_sizes = nodes[-1], sizes[-1]
+            nodes.append(
+                {
+                    pattern_id: 1
+                    + sum(previous_nodes[n] for _, n in neighbors[pattern_id])
+                    for pattern_id in patterns
+                }
+            )
+            sizes.append(
+                {
+                    pattern_id: patterns[pattern_id]
+                    + sum(previous_sizes[n] for _, n in neighbors[pattern_id])
+                    for pattern_id in patterns
+                }
+            )
+
+        with self._lock:
+            if generation == self._generation:
+                self._nodes = nodes
+                self._bytes = sizes
+        return nodes, sizes
+
+    def estimate(self, pattern_id: int, depth: int, session: Session) -> QueryCost:
+        # Work on a snapshot so a concurrent clear() can't empty the lists under us
+        with self._lock:
+            nodes, sizes = self._nodes, self._bytes
+        if not nodes:
+            with self._load_lock:
+                with self._lock:
+                    nodes, sizes = self._nodes, self._bytes
+                if not nodes:
+                    nodes, sizes = self.load(session)
+
+        depth = min(max(depth, 0), MAX_DEPTH)
+        return QueryCost(
+            nodes=nodes[depth].get(pattern_id, 1),
+            bytes=sizes[depth].get(pattern_id, NODE_OVERHEAD_BYTES),
+        )
+
+
+class ResponseBudget:
+    """
+    Node and byte allowance shared by every level of a single `get_pattern` expansion
+    """
+
+    def __init__(self, max_nodes: int, max_bytes: int):
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+        self.nodes = 0
+        self.bytes = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(settings.max_response_nodes, settings.max_response_bytes)
+
+    @property
+    def exhausted(self) -> bool:
+        return self.nodes >= self.max_nodes or self.bytes >= self.max_bytes
+
+    def spend(self, pattern: Patterns):
+        self.nodes += 1
+        self.bytes += node_size(pattern)
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.refill_rate
+        )
+        self.updated = now
+
+    def consume(self, amount: float) -> float:
+        """
+        Take `amount` tokens from the bucket
+
+        Returns 0 on success, otherwise the number of seconds until enough tokens are available
+        """
+        self.refill(time.monotonic())
+
+        # A single request can never cost more than a full bucket
+        amount = min(amount, self.capacity)
+        if amount <= self.tokens:
+            self.tokens -= amount
+            return 0
+        return (amount - self.tokens) / self.refill_rate
+
+
+class ClientLimiter:
+    """
+    Per-client token buckets, charged by query cost rather than request count
+    """
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._last_sweep = time.monotonic()
+
+    def charge(self, client: str, cost: float) -> int:
+        """
+        Returns 0 if the client can afford `cost`, otherwise the seconds to wait before retrying
+        """
+        with self._lock:
+            self._sweep()
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(
+                    self.capacity, self.refill_rate
+                )
+            wait = bucket.consume(cost)
+        return math.ceil(wait)
+
+    def _sweep(self):
+        """
+        Drop buckets that have refilled to capacity, a new bucket is identical to them
+        """
+        now = time.monotonic()
+        if now - self._last_sweep < self.capacity / self.refill_rate:
+            return
+        self._last_sweep = now
+        for client, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._buckets[client]
+
+    def clear(self):
+        with self._lock:
+            self._buckets = {}
+
+
+def client_key(scope) -> str:
+    client = scope.get("client")
+    return client[0] if client else "anonymous"
+
+
+neighborhoods = NeighborhoodIndex()
+limiter = ClientLimiter(settings.rate_limit_capacity, settings.rate_limit_refill_rate)
@@ -7,16 +7,24 @@ from apscheduler.triggers.interval import IntervalTrigger
 
 from apl_api.routes import router
 from apl_api.parser import update_data, download_markdown
+from apl_api.coalesce import CoalesceMiddleware, stats
 from apl_api.config import settings
+from apl_api.cost import limiter, neighborhoods
+
+
+def refresh_data():
+    update_data()
+    # Neighborhood sizes are rebuilt from the new database on the next request
+    neighborhoods.clear()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     download_markdown()
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(update_data, IntervalTrigger(days=settings.update_interval))
+    scheduler.add_job(refresh_data, IntervalTrigger(days=settings.update_interval))
     scheduler.start()
-    update_data()
+    refresh_data()
     yield
     if os.path.exists(settings.database):
         os.remove(settings.database)
@@ -33,4 +41,5 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+app.add_middleware(CoalesceMiddleware, stats=stats, limiter=limiter)
 app.include_router(router)
@@ -33,6 +33,8 @@ class PatternResponse(BaseModel):
     tag: str
     forward_links: List["PatternResponse"] = []
     backlinks: List["PatternResponse"] = []
+    # True when links in this pattern's tree were dropped to stay within the response budget
+    truncated: bool = False
 
     class Config:
         from_attributes = True
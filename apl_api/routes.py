@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from fastapi.responses import RedirectResponse
 from typing import Annotated, List
 from sqlmodel import Session, select
 
 from apl_api.parser import update_data
+from apl_api.coalesce import stats
+from apl_api.config import settings
+from apl_api.cost import (
+    RATE_LIMIT_DETAIL,
+    ResponseBudget,
+    client_key,
+    limiter,
+    neighborhoods,
+)
 from apl_api.models import engine, PatternLinks, PatternResponse, Patterns
 
 router = APIRouter()
@@ -15,6 +24,7 @@ def get_session():
 
 
 SessionDep = Annotated[Session, Depends(get_session)]
+DepthQuery = Annotated[int, Query(le=3)]
 
 tags_metadata = [
     {"name": "patterns", "description": "Operations to get and find different patterns"}
@@ -26,21 +36,87 @@ async def index():
     return RedirectResponse(url="/docs")
 
 
-@router.get("/id/{id}", response_model=PatternResponse, tags=["patterns"])
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return {"coalescing": stats}
+
+
+def charge_query_cost(
+    request: Request, session: SessionDep, pattern_id: int, depth: int
+):
+    """
+    Reject requests whose estimated size is too large and charge the client's
+    token bucket by the number of patterns the request will actually return
+    """
+    cost = neighborhoods.estimate(pattern_id=pattern_id, depth=depth, session=session)
+    if cost.nodes > settings.max_query_cost or cost.bytes > settings.max_query_bytes:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Query too expensive (~{cost.nodes} patterns, ~{cost.bytes} bytes), "
+            "try a lower depth",
+        )
+
+    charge = min(cost.nodes, settings.max_response_nodes)
+    retry_after = limiter.charge(client_key(request.scope), charge)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail=RATE_LIMIT_DETAIL,
+            headers={"Retry-After": str(retry_after)},
+        )
+    # Coalesced requests sharing this response are charged the same amount
+    request.state.query_cost = charge
+
+
+def charge_cost_by_id(
+    request: Request, session: SessionDep, pattern_id: int, depth: DepthQuery = 1
+):
+    charge_query_cost(request, session, pattern_id, depth)
+
+
+def resolve_pattern_name(pattern_name: str, session: SessionDep) -> int:
+    statement = select(Patterns.id).where(Patterns.name == pattern_name.lower())
+    pattern_id = session.exec(statement).first()
+    if pattern_id is None:
+        raise HTTPException(status_code=404, detail="Pattern not found")
+    return pattern_id
+
+
+# FastAPI caches dependencies per request, so the name is only looked up once
+PatternNameDep = Annotated[int, Depends(resolve_pattern_name)]
+
+
+def charge_cost_by_name(
+    request: Request,
+    session: SessionDep,
+    pattern_id: PatternNameDep,
+    depth: DepthQuery = 1,
+):
+    charge_query_cost(request, session, pattern_id, depth)
+
+
+@router.get(
+    "/id/{id}",
+    response_model=PatternResponse,
+    tags=["patterns"],
+    dependencies=[Depends(charge_cost_by_id)],
+)
 def get_pattern_by_id(
-    pattern_id: int, session: SessionDep, depth: Annotated[int, Query(le=3)] = 1
+    pattern_id: int, session: SessionDep, depth: DepthQuery = 1
 ) -> PatternResponse:
     return get_pattern(pattern_id=pattern_id, session=session, depth=depth)
 
 
-@router.get("/name/{pattern_name}", response_model=PatternResponse, tags=["patterns"])
+@router.get(
+    "/name/{pattern_name}",
+    response_model=PatternResponse,
+    tags=["patterns"],
+    dependencies=[Depends(charge_cost_by_name)],
+)
 def get_pattern_by_name(
-    pattern_name: str, session: SessionDep, depth: Annotated[int, Query(le=3)] = 1
+    pattern_id: PatternNameDep, session: SessionDep, depth: DepthQuery = 1
 ) -> PatternResponse:
-    statement = select(Patterns).where(Patterns.name == pattern_name.lower())
-    pattern = session.exec(statement).first()
-
-    return get_pattern(pattern_id=pattern.id, session=session, depth=depth)
+    return get_pattern(pattern_id=pattern_id, session=session, depth=depth)
 
 
 @router.get("/find/{name}", response_model=List[Patterns], tags=["patterns"])
@@ -83,11 +159,18 @@ def get_patterns_by_tag(tag: str, session: SessionDep) -> List[Patterns]:
 
 
 def get_pattern(
-    pattern_id: int, session: SessionDep, depth: Annotated[int, Query(le=3)] = 1
+    pattern_id: int,
+    session: SessionDep,
+    depth: DepthQuery = 1,
+    budget: ResponseBudget | None = None,
 ) -> PatternResponse:
+    if budget is None:
+        budget = ResponseBudget.from_settings()
+
     pattern = session.get(Patterns, pattern_id)
     if not pattern:
         raise HTTPException(status_code=404, detail="Pattern not found")
+    budget.spend(pattern)
 
     if depth > 0:
         # Recursively fetch forward links
@@ -99,10 +182,9 @@ def get_pattern(
         forward_links = session.exec(
             select(Patterns).where(Patterns.id.in_(forward_link_ids))
         ).all()
-        forward_link_responses = [
-            get_pattern_by_id(pattern_id=link.id, session=session, depth=depth - 1)
-            for link in forward_links
-        ]
+        forward_link_responses, forward_truncated = expand_links(
+            forward_links, session=session, depth=depth - 1, budget=budget
+        )
 
         # Recursively fetch backlinks
         backlink_ids = session.exec(
@@ -113,13 +195,14 @@ def get_pattern(
         backlinks = session.exec(
             select(Patterns).where(Patterns.id.in_(backlink_ids))
         ).all()
-        backlink_responses = [
-            get_pattern_by_id(pattern_id=link.id, session=session, depth=depth - 1)
-            for link in backlinks
-        ]
+        backlink_responses, backlinks_truncated = expand_links(
+            backlinks, session=session, depth=depth - 1, budget=budget
+        )
+        truncated = forward_truncated or backlinks_truncated
     else:
         forward_link_responses = []
         backlink_responses = []
+        truncated = False
 
     # Return the pattern data with links
     return PatternResponse(
@@ -132,4 +215,24 @@ def get_pattern(
         tag=pattern.tag,
         forward_links=forward_link_responses,
         backlinks=backlink_responses,
+        truncated=truncated,
     )
+
+
+def expand_links(
+    links: List[Patterns], session: SessionDep, depth: int, budget: ResponseBudget
+) -> tuple[List[PatternResponse], bool]:
+    """
+    Expand linked patterns until the response budget runs out
+
+    Returns the expanded patterns and whether any links (here or further down) were dropped
+    """
+    responses = []
+    for link in links:
+        if budget.exhausted:
+            return responses, True
+        response = get_pattern(
+            pattern_id=link.id, session=session, depth=depth, budget=budget
+        )
+        responses.append(response)
+    return responses, any(response.truncated for response in responses)
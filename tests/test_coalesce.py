@@ -0,0 +1,122 @@
+import asyncio
+from apl_api.coalesce import CoalesceMiddleware, CoalesceStats, coalesce_key
+from apl_api.cost import ClientLimiter
+
+
+def make_scope(path, query=b"", method="GET", client="127.0.0.1"):
+    return {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query,
+        "client": (client, 123),
+        "headers": [],
+    }
+
+
+def make_app(status=200, cost=0):
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["path"])
+        scope.setdefault("state", {})["query_cost"] = cost
+        await asyncio.sleep(0.01)
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": b"pattern"})
+
+    return app, calls
+
+
+def run_requests(middleware, scopes):
+    async def request(scope):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        await middleware(scope, None, send)
+        return messages
+
+    async def main():
+        return await asyncio.gather(*(request(scope) for scope in scopes))
+
+    return asyncio.run(main())
+
+
+def test_coalesce_key_normalizes_query_and_name():
+    assert coalesce_key(make_scope("/id/1", b"depth=3&pattern_id=1")) == coalesce_key(
+        make_scope("/id/1", b"pattern_id=1&depth=3")
+    )
+    # ASGI servers hand over an already decoded path
+    assert coalesce_key(make_scope("/name/Pattern One")) == coalesce_key(
+        make_scope("/name/pattern one")
+    )
+    assert coalesce_key(make_scope("/name/%41")) != coalesce_key(make_scope("/name/a"))
+    # A blank depth is a validation error, not the default depth
+    assert coalesce_key(make_scope("/id/1", b"depth=")) != coalesce_key(
+        make_scope("/id/1", b"")
+    )
+
+
+def test_coalesce_key_keeps_order_of_repeated_parameters():
+    # The last value wins, so these are different requests
+    assert coalesce_key(make_scope("/id/1", b"depth=1&depth=0")) != coalesce_key(
+        make_scope("/id/1", b"depth=0&depth=1")
+    )
+
+
+def test_concurrent_identical_requests_share_one_execution():
+    app, calls = make_app()
+    stats = CoalesceStats()
+    middleware = CoalesceMiddleware(app, stats=stats)
+
+    responses = run_requests(middleware, [make_scope("/id/1", b"depth=3")] * 5)
+
+    assert len(calls) == 1
+    assert all(response[-1]["body"] == b"pattern" for response in responses)
+    assert stats == CoalesceStats(requests=5, executions=1, coalesced=4)
+
+
+def test_different_requests_are_not_coalesced():
+    app, calls = make_app()
+    middleware = CoalesceMiddleware(app)
+
+    run_requests(middleware, [make_scope("/id/1"), make_scope("/id/2")])
+
+    assert len(calls) == 2
+    assert middleware.stats.coalesced == 0
+
+
+def test_error_responses_are_not_shared():
+    app, calls = make_app(status=429)
+    middleware = CoalesceMiddleware(app)
+
+    responses = run_requests(middleware, [make_scope("/id/1")] * 3)
+
+    assert len(calls) == 3
+    assert all(response[0]["status"] == 429 for response in responses)
+    assert middleware.stats.coalesced == 0
+
+
+def test_other_paths_bypass_coalescing():
+    app, calls = make_app()
+    middleware = CoalesceMiddleware(app)
+
+    run_requests(middleware, [make_scope("/tag/town")] * 2)
+
+    assert len(calls) == 2
+    assert middleware.stats.requests == 0
+
+
+def test_waiters_are_charged_for_shared_responses():
+    app, calls = make_app(cost=10)
+    limiter = ClientLimiter(capacity=25, refill_rate=0.001)
+    # The leader is charged by the route dependency, the fake app skips that
+    middleware = CoalesceMiddleware(app, limiter=limiter)
+
+    responses = run_requests(middleware, [make_scope("/id/1")] * 5)
+
+    assert len(calls) == 1
+    statuses = [response[0]["status"] for response in responses]
+    assert statuses == [200, 200, 200, 429, 429]
+    assert middleware.stats.coalesced == 2
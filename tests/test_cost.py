@@ -0,0 +1,36 @@
+from apl_api.cost import ClientLimiter, TokenBucket
+
+
+def test_token_bucket_consume():
+    bucket = TokenBucket(capacity=10, refill_rate=1)
+    assert bucket.consume(6) == 0
+    assert bucket.consume(6) > 0
+    assert bucket.consume(4) == 0
+
+
+def test_token_bucket_caps_cost_at_capacity():
+    bucket = TokenBucket(capacity=10, refill_rate=1)
+    assert bucket.consume(500) == 0
+    assert bucket.consume(1) > 0
+
+
+def test_client_limiter_charges_by_cost():
+    limiter = ClientLimiter(capacity=100, refill_rate=0.001)
+    assert limiter.charge("client-a", 80) == 0
+    assert limiter.charge("client-a", 80) > 0
+    # Buckets are independent per client
+    assert limiter.charge("client-b", 80) == 0
+
+
+def test_client_limiter_evicts_refilled_buckets():
+    limiter = ClientLimiter(capacity=10, refill_rate=1)
+    limiter.charge("client-a", 5)
+    limiter.charge("client-b", 10)
+
+    # Pretend a full refill period has passed since the last sweep
+    for bucket in limiter._buckets.values():
+        bucket.updated -= 5
+    limiter._last_sweep -= 10
+    limiter.charge("client-c", 1)
+
+    assert set(limiter._buckets) == {"client-b", "client-c"}
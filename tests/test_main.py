@@ -1,17 +1,22 @@
 # Import dependencies
 import os
+import threading
+import time
 import pytest
+from fastapi import HTTPException
 from sqlmodel import SQLModel, Session, create_engine
-from apl_api.main import (
-    app,
+from apl_api.cost import NeighborhoodIndex, ResponseBudget
+from apl_api.main import app
+from apl_api.models import Patterns, PatternLinks
+from apl_api.routes import (
     get_pattern_by_id,
     get_pattern_by_name,
     find_pattern_by_name,
     get_pattern_by_page_number,
     get_patterns_by_confidence,
     get_patterns_by_tag,
-    Patterns,
-    PatternLinks,
+    get_pattern,
+    resolve_pattern_name,
 )
 
 # Setup test database
@@ -82,10 +87,17 @@ def test_get_pattern_by_id(session):
 
 
 def test_get_pattern_by_name(session):
-    result = get_pattern_by_name(pattern_name="pattern one", session=session, depth=1)
+    pattern_id = resolve_pattern_name(pattern_name="Pattern One", session=session)
+    result = get_pattern_by_name(pattern_id=pattern_id, session=session, depth=1)
     assert result.id == 1
 
 
+def test_resolve_unknown_pattern_name(session):
+    with pytest.raises(HTTPException) as exc_info:
+        resolve_pattern_name(pattern_name="no such pattern", session=session)
+    assert exc_info.value.status_code == 404
+
+
 def test_find_pattern_by_name(session):
     results = find_pattern_by_name(name="one", session=session)
     assert any("pattern one" in pattern.name for pattern in results)
@@ -104,3 +116,70 @@ def test_get_patterns_by_confidence(session):
 def test_get_patterns_by_tag(session):
     results = get_patterns_by_tag(tag="tag1", session=session)
     assert any("tag1" in pattern.tag for pattern in results)
+
+
+def test_get_pattern_not_truncated(session):
+    result = get_pattern_by_id(pattern_id=1, session=session, depth=3)
+    assert result.truncated is False
+    assert result.forward_links[0].id == 2
+
+
+def test_get_pattern_truncated_by_node_budget(session):
+    budget = ResponseBudget(max_nodes=1, max_bytes=1_000_000)
+    result = get_pattern(pattern_id=1, session=session, depth=1, budget=budget)
+    assert result.truncated is True
+    assert result.forward_links == []
+
+
+def test_get_pattern_truncated_by_byte_budget(session):
+    budget = ResponseBudget(max_nodes=1000, max_bytes=1)
+    result = get_pattern(pattern_id=1, session=session, depth=1, budget=budget)
+    assert result.truncated is True
+    assert budget.nodes == 1
+
+
+def test_neighborhood_estimate(session):
+    index = NeighborhoodIndex()
+    assert index.estimate(pattern_id=1, depth=0, session=session).nodes == 1
+    assert index.estimate(pattern_id=1, depth=1, session=session).nodes == 2
+    # 1 -> 2 -> 1 (backlink) -> 2
+    assert index.estimate(pattern_id=1, depth=3, session=session).nodes == 4
+    assert index.estimate(pattern_id=99, depth=3, session=session).nodes == 1
+
+
+def test_neighborhood_load_discarded_after_clear(session, mocker):
+    index = NeighborhoodIndex()
+    exec_statement = session.exec
+
+    # The database is rebuilt (and the index cleared) while the load is reading it
+    def exec_and_clear(statement):
+        index.clear()
+        return exec_statement(statement)
+
+    mocker.patch.object(session, "exec", side_effect=exec_and_clear)
+    assert index.estimate(pattern_id=1, depth=1, session=session).nodes == 2
+    assert index._nodes == []
+
+
+def test_neighborhood_concurrent_estimates_load_once(session, mocker):
+    index = NeighborhoodIndex()
+    load = index.load
+    start = threading.Barrier(2)
+
+    def slow_load(session):
+        time.sleep(0.05)
+        return load(session)
+
+    mocked_load = mocker.patch.object(index, "load", side_effect=slow_load)
+
+    def estimate():
+        start.wait()
+        assert index.estimate(pattern_id=1, depth=1, session=session).nodes == 2
+
+    threads = [threading.Thread(target=estimate) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert mocked_load.call_count == 1
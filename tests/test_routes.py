@@ -0,0 +1,132 @@
+import asyncio
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, Session, create_engine
+from apl_api.config import settings
+from apl_api.cost import limiter, neighborhoods
+from apl_api.main import app
+from apl_api.models import Patterns, PatternLinks
+from apl_api.routes import get_session
+
+engine = create_engine(
+    "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+)
+
+
+def override_get_session():
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    SQLModel.metadata.create_all(bind=engine)
+    with Session(engine) as session:
+        # Pattern one links to, and is linked from, patterns two to six
+        for i, name in enumerate(["one", "two", "three", "four", "five", "six"], 1):
+            session.add(
+                Patterns(
+                    id=i,
+                    name=f"pattern {name}",
+                    problem="Problem",
+                    solution="Solution",
+                    page_number=i * 10,
+                    confidence=1,
+                    tag="tag",
+                )
+            )
+        for i in range(2, 7):
+            session.add(PatternLinks(pattern_id=1, linked_pattern_id=i))
+            session.add(PatternLinks(pattern_id=i, linked_pattern_id=1))
+        session.commit()
+
+    app.dependency_overrides[get_session] = override_get_session
+    yield
+    del app.dependency_overrides[get_session]
+    SQLModel.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(settings, "max_query_cost", 50)
+    monkeypatch.setattr(settings, "max_query_bytes", 1_000_000)
+    monkeypatch.setattr(limiter, "capacity", 100)
+    monkeypatch.setattr(limiter, "refill_rate", 0.001)
+    neighborhoods.clear()
+    limiter.clear()
+    yield
+    neighborhoods.clear()
+    limiter.clear()
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+def test_get_pattern_by_id_within_budget(client):
+    response = client.get("/id/1", params={"pattern_id": 1, "depth": 1})
+    assert response.status_code == 200
+    assert len(response.json()["forward_links"]) == 5
+
+
+def test_expensive_query_by_id_rejected(client):
+    # Depth 2 from the hub expands to 1 + 10 * (1 + 2) = 31 patterns
+    settings.max_query_cost = 30
+    response = client.get("/id/1", params={"pattern_id": 1, "depth": 2})
+    assert response.status_code == 422
+    assert "too expensive" in response.json()["detail"]
+
+
+def test_large_query_by_id_rejected(client):
+    # Each pattern is estimated at roughly 180 bytes, the hub at depth 1 at ~2 kB
+    settings.max_query_bytes = 1000
+    response = client.get("/id/1", params={"pattern_id": 1, "depth": 1})
+    assert response.status_code == 422
+    assert "bytes" in response.json()["detail"]
+    assert client.get("/id/2", params={"pattern_id": 2, "depth": 0}).status_code == 200
+
+
+def test_expensive_query_by_name_rejected(client):
+    settings.max_query_cost = 10
+    response = client.get("/name/Pattern One", params={"depth": 1})
+    assert response.status_code == 422
+
+
+def test_unknown_name_not_found_and_not_charged(client):
+    limiter.capacity = 1
+    response = client.get("/name/no such pattern", params={"depth": 3})
+    assert response.status_code == 404
+    assert client.get("/name/pattern two", params={"depth": 0}).status_code == 200
+
+
+def test_rate_limit_charged_by_cost(client):
+    limiter.capacity = 15
+    # The hub at depth 1 costs 11 patterns, a leaf at depth 0 costs 1
+    assert client.get("/id/1", params={"pattern_id": 1}).status_code == 200
+    assert client.get("/id/2", params={"pattern_id": 2, "depth": 0}).status_code == 200
+
+    response = client.get("/id/1", params={"pattern_id": 1})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+
+def test_concurrent_identical_requests_charged_per_request():
+    # Each /id/1 request at depth 1 costs 11, so only one fits in the bucket
+    limiter.capacity = 20
+
+    async def send_requests():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            requests = [
+                c.get("/id/1", params={"pattern_id": 1, "depth": 1}) for _ in range(20)
+            ]
+            return await asyncio.gather(*requests)
+
+    responses = asyncio.run(send_requests())
+
+    statuses = [response.status_code for response in responses]
+    assert statuses.count(200) == 1
+    assert statuses.count(429) == 19